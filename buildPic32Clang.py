@@ -52,13 +52,18 @@
 #
 
 import argparse
+from collections.abc import Callable, Iterable
+import concurrent.futures
+import hashlib
 import os
 from pathlib import Path
 import pic32_target_variants
 from pic32_target_variants import TargetVariant
 import shutil
 import subprocess
-import time
+import sys
+import tempfile
+import threading
 import tkinter
 import tkinter.filedialog
 
@@ -72,6 +77,17 @@ INSTALL_PREFIX = ROOT_WORKING_DIR / 'install'
 
 CMAKE_CACHE_DIR = Path(os.path.dirname(os.path.realpath(__file__)), 'cmake_caches')
 
+# Variants can be built concurrently, but they share include directories in the install location.
+# Hold this while installing so that two builds do not try to write the same headers at once.
+INSTALL_LOCK = threading.Lock()
+
+# This file is put into CMake build directories to remember the options CMake was last run with.
+CMAKE_CONFIGURE_HASH_FILE = '.pic32clang-configure-hash'
+
+# This file is put into build directories to remember the git commits of the sources built there
+# and anything else that should force a clean build when it changes, like the compiler used.
+SOURCE_REVISION_FILE = '.pic32clang-source-revision'
+
 
 # These are the build steps this script can do. The steps to be done can be given on the 
 # command line or 'all' can be used to do all of these.
@@ -82,6 +98,16 @@ LLVM_REPO_URL = 'https://github.com/llvm/llvm-project.git'
 LLVM_REPO_BRANCH = 'llvmorg-19.1.5'
 LLVM_SRC_DIR = ROOT_WORKING_DIR / 'llvm'
 
+# These are the CMake options for a single-stage LLVM build that do not depend on the command line.
+# The two-stage build gets these from its CMake cache files instead.
+LLVM_SINGLE_STAGE_CMAKE_ARGS = (
+    '-DCLANG_CONFIG_FILE_SYSTEM_DIR=../config',
+    '-DLLVM_OPTIMIZED_TABLEGEN=ON',
+    '-DLLVM_USE_SPLIT_DWARF=ON',
+    '-DLLVM_TARGETS_TO_BUILD=ARM;Mips',
+    '-DLLVM_ENABLE_PROJECTS=clang;clang-tools-extra;lld;lldb;polly',
+)
+
 # Use my clone of Musl for now because it will contain mods to get it to work
 # on our PIC32 and SAM devices.
 #MUSL_REPO_URL = 'https://git.musl-libc.org/cgit/musl.git'
@@ -119,10 +145,21 @@ def is_windows() -> bool:
     return 'nt' == os.name
 
 
-def get_cmake_bool(sel: bool) -> str:
-    '''Return ON or OFF based on the given boolean for use with CMake commands.
+def get_compiler_launcher_args() -> list[str]:
+    '''Return CMake arguments that run compiles through ccache or sccache, or an empty list if
+    neither one can be found.
+
+    This lets the library builds reuse object files from previous runs and from other variants that
+    compile the same files with the same options.
     '''
-    return 'ON' if sel else 'OFF'
+    for launcher in ('ccache', 'sccache'):
+        launcher_path = shutil.which(launcher)
+        if launcher_path:
+            launcher_path = Path(launcher_path).as_posix()
+            return [f'-DCMAKE_C_COMPILER_LAUNCHER={launcher_path}',
+                    f'-DCMAKE_CXX_COMPILER_LAUNCHER={launcher_path}']
+
+    return []
 
 
 def get_lib_build_dir(libname: str, variant: TargetVariant) -> Path:
@@ -167,35 +204,174 @@ def get_lib_build_tool_abspath(args: argparse.Namespace) -> Path:
 def remake_dirs(dir: Path) -> None:
     '''Remove and make the given directory and its subdirectories.
     
-    Use this to remove build directories so that a clean build is done.
+    Use this to remove build directories so that a clean build is done. The old directory is moved
+    out of the way and deleted on a background thread so that the build can start right away instead
+    of waiting on what could be minutes of unlinking for something like an old LLVM build.
+
+    If the script exits before that delete is done, then the rest of the old directory is left next
+    to the new one in a directory named like "<name>.<random>.deleteme". Those are removed the next
+    time this is called for the same directory.
     '''
+    def remove_trash_dirs(trash_dirs: list[Path]) -> None:
+        for trash_dir in trash_dirs:
+            shutil.rmtree(trash_dir, ignore_errors=True)
+
+    trash_dirs = list(dir.parent.glob(f'{dir.name}.*.deleteme'))
+
     if dir.exists():
-        shutil.rmtree(dir)
+        # Move the old directory into a uniquely-named temporary directory next to it so that
+        # leftovers from a previous run that was interrupted cannot collide with it. If the move
+        # fails (say, because Windows has a file in there open), then just delete it in place.
+        trash_dir = Path(tempfile.mkdtemp(prefix=f'{dir.name}.', suffix='.deleteme', dir=dir.parent))
+        try:
+            os.rename(dir, trash_dir / dir.name)
+        except OSError:
+            shutil.rmtree(trash_dir, ignore_errors=True)
+            shutil.rmtree(dir)
+        else:
+            trash_dirs.append(trash_dir)
+
+    if trash_dirs:
+        # This is a daemon thread so that exiting (or Ctrl-C) does not wait on the delete. Anything
+        # not deleted by then is picked up by the next call as described above.
+        threading.Thread(target=remove_trash_dirs, args=(trash_dirs,), daemon=True).start()
 
     os.makedirs(dir)
 
 
+def get_git_revision(repo_dir: Path) -> str:
+    '''Return the hash of the HEAD commit of the given git repo or an empty string if the directory
+    is not a git repo.
+    '''
+    try:
+        result = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repo_dir, capture_output=True,
+                                text=True)
+    except OSError:
+        return ''
+
+    return result.stdout.strip() if 0 == result.returncode else ''
+
+
+def make_build_dir(args: argparse.Namespace, dir: Path, src_dirs: list[Path],
+                   build_tools: list[str] | None = None) -> None:
+    '''Make the given build directory for building the sources in the given source directories.
+
+    Any old build directory is removed first unless an incremental build was requested on the
+    command line. Even then, the old directory is removed if it was last used to build a different
+    git commit of any of the sources. File times alone cannot be trusted for that because switching
+    to an older commit can give the sources times older than the objects already built from newer
+    ones. The optional build tools are strings, like the path to the compiler, that are checked the
+    same way for builds that would not otherwise notice when those change.
+    '''
+    build_id = '\n'.join([*(get_git_revision(src_dir) for src_dir in src_dirs),
+                          *(build_tools or [])])
+    revision_path = dir / SOURCE_REVISION_FILE
+
+    if args.incremental  and  revision_path.exists()  and  revision_path.read_text() == build_id:
+        return
+
+    remake_dirs(dir)
+    revision_path.write_text(build_id)
+
+
+def get_cmake_configure_hash(gen_cmd: list[str], build_dir: Path) -> str:
+    '''Return a hash of the given CMake generate command used to tell if it needs to be run again.
+
+    This includes the contents of any CMake cache files given with the '-C' option, so editing one
+    of those files will cause CMake to be run again even though the command itself is the same. A
+    cache file can pull in others, like the stage 1 LLVM cache does with the stage 2 cache, so every
+    cache file in this script's 'cmake_caches' directory is included, too, if any '-C' option is
+    given. Any relative paths in the command are treated as being relative to the given build
+    directory.
+
+    CMake does not care about the order of '-D' options next to each other except that a later one
+    for a variable replaces an earlier one. Each run of '-D' options between other arguments is
+    therefore hashed as only the last option for each variable sorted by variable name, so moving
+    options around in this script will not cause CMake to be re-run. The order of the other
+    arguments, like '-C', relative to those runs is kept because that does matter to CMake. The
+    command itself is not changed, so CMake still sees the options in the order given.
+    '''
+    hasher = hashlib.sha256()
+    defines: dict[str, str] = {}
+
+    def hash_defines() -> None:
+        for name in sorted(defines):
+            hasher.update(defines[name].encode('utf-8') + b'\0')
+        defines.clear()
+
+    prev_arg = ''
+    for arg in gen_cmd:
+        if arg.startswith('-D'):
+            # The variable name is everything before the '=' and the optional ':TYPE'.
+            name = arg[2:].partition('=')[0].partition(':')[0]
+            defines[name] = arg
+        else:
+            hash_defines()
+            hasher.update(arg.encode('utf-8') + b'\0')
+
+            if '-C' == prev_arg:
+                hasher.update((build_dir / arg).read_bytes())
+
+        prev_arg = arg
+
+    hash_defines()
+
+    if '-C' in gen_cmd:
+        for cache_path in sorted(CMAKE_CACHE_DIR.glob('*.cmake')):
+            hasher.update(cache_path.name.encode('utf-8') + b'\0')
+            hasher.update(cache_path.read_bytes())
+
+    return hasher.hexdigest()
+
+
+def run_cmake_configure(args: argparse.Namespace, gen_cmd: list[str], info_str: str,
+                        build_dir: Path) -> None:
+    '''Run the given CMake generate command in the build directory unless it has already been run
+    there with the same arguments.
+
+    The command is skipped only for incremental builds in which the build directory already has a
+    CMakeCache.txt file and the hash saved from the last successful run matches. CMake still checks
+    if it needs to regenerate the build files when the build is started, so this skips only the
+    time spent re-running all of the compiler and feature checks.
+    '''
+    hash_path = build_dir / CMAKE_CONFIGURE_HASH_FILE
+    cmd_hash = get_cmake_configure_hash(gen_cmd, build_dir)
+
+    if args.incremental  and  (build_dir / 'CMakeCache.txt').exists()  and  hash_path.exists():
+        if hash_path.read_text() == cmd_hash:
+            print_line_with_info_str(f'CMake configuration is up to date in {build_dir.as_posix()}',
+                                     info_str)
+            return
+
+    # Remove the old hash first so that a failed run is not mistaken for a good one next time.
+    hash_path.unlink(missing_ok=True)
+    run_subprocess(gen_cmd, info_str, build_dir, passthrough=args.plain_output)
+    hash_path.write_text(cmd_hash)
+
+
 def print_line_with_info_str(line: str, info_str: str) -> None:
     '''Print the given line while also using ANSI control codes to print the given info string in 
     inverted colors below it. The cursor will be on a new line when this is done.
     '''
     # Finish the current line before moving to the next by printing everything before the first newline.
-    split_line = line.split('\n', 1)
-    print(split_line[0], end='')
+    first_line, newline, other_lines = line.partition('\n')
 
     # Control codes start with \x1b (ESC) and [
     #   '7m' enables inverted colors (reverse video)
     #   '27m' disabled inverted colors
     #   'K' clears the rest of the line starting at the cursor
     #   'A' moves up one line
-    print('\n\x1b[K\x1b[A', end='')
-    if len(split_line) > 1:
-        print('\n' + split_line[1], end='')
-    print('\n\n\x1b[7m' + info_str + '\x1b[27m\x1b[K\r\x1b[A', end='', flush=True)
+    #
+    # Everything is written in one go so that this costs a single write to the console no matter
+    # how many lines are given, which matters for builds that print a lot of output.
+    sys.stdout.write(f'{first_line}\n\x1b[K\x1b[A{newline}{other_lines}'
+                     f'\n\n\x1b[7m{info_str}\x1b[27m\x1b[K\r\x1b[A')
+    sys.stdout.flush()
 
 
 def run_subprocess(cmd_args: list[str], info_str: str, working_dir: Path = None, 
-                   penv: dict[str, str] = None, use_shell: bool = False) -> None:
+                   penv: dict[str, str] = None, use_shell: bool = False,
+                   passthrough: bool = False) -> None:
     '''Run the given command while printing the given step string at the end of output.
 
     Run the command given by the list cmd_args in which the first item in the list is the name of
@@ -219,6 +395,11 @@ def run_subprocess(cmd_args: list[str], info_str: str, working_dir: Path = None,
     this is True, then 'cmd_args' should be a single string formatted just like it would be if the
     command were typed into the terminal. See the Python documentation for subprocess.Popen() for
     more info.
+
+    The sixth argument indicates if the command should write its output directly to this script's
+    console instead of having this script read and re-print it. This is faster for commands that
+    produce a lot of output, but the info string is printed only once at the start and the
+    CalledProcessError raised on failure will not contain the command's output.
     '''
     # print('Called run_subprocess with the following:')
     # print(f'{cmd_args=}')
@@ -226,38 +407,50 @@ def run_subprocess(cmd_args: list[str], info_str: str, working_dir: Path = None,
     # print('----------\n')
     # return
 
+    if passthrough:
+        if info_str:
+            print(f'\n\x1b[7m{info_str}\x1b[27m\x1b[K', flush=True)
+
+        proc = subprocess.Popen(cmd_args, cwd=working_dir, env=penv, shell=use_shell)
+        if proc.wait() != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd_args)
+        return
+
     if info_str:
         print_line_with_info_str('', info_str)
 
-    output = ''
-    prev_output = ''
-    remaining_output = ''
+    # Output is collected as raw bytes and only complete lines are decoded and printed. This keeps
+    # a multi-byte character that is split across two reads intact and avoids building up new
+    # strings every time a line straddles the end of a read.
+    line_buf = bytearray()
+    last_lines = ''
     proc = subprocess.Popen(cmd_args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=False, 
-                            cwd=working_dir, bufsize=0, env=penv, shell=use_shell)
-
-    while None == proc.poll():
-        while True:
-            # We need a number here or else this will block. On Unix, we can use os.set_blocking()
-            # to disable this, but not on Windows.
-            output = proc.stdout.read(4096).decode('utf-8', 'backslashreplace')
-            if not output:
-                break
-
-            out_lines = output.rsplit('\n', 1)
-            if len(out_lines) > 1:
-                # Found newline, so print what we found (rsplit removes the delimiter).
-                print_line_with_info_str(remaining_output + out_lines[0], info_str)
-                remaining_output = out_lines[1]
-            else:
-                print(remaining_output + out_lines[0], end='', flush=True)
-                remaining_output = ''
-
-            prev_output = output
-
-        time.sleep(0.001)
-
-    # Get any straggling lines after the process has ended
-    remaining_output += proc.communicate()[0].decode('utf-8', 'backslashreplace')
+                            cwd=working_dir, bufsize=-1, env=penv, shell=use_shell)
+
+    # The read blocks until the process writes more output and returns an empty result only once the
+    # process closes its end of the pipe, which normally happens when it exits. There is no need to
+    # poll the process or sleep in between reads. Only one output line is buffered at a time, so
+    # memory use stays the same no matter how much the command prints.
+    while True:
+        # Use read1() so that this returns whatever is available (up to the given size) instead of
+        # waiting for the full amount.
+        output = proc.stdout.read1(65536)
+        if not output:
+            break
+
+        line_buf.extend(output)
+        newline_index = line_buf.rfind(b'\n')
+        if newline_index >= 0:
+            # Found newline, so print everything before it and keep the partial line after it.
+            last_lines = line_buf[:newline_index].decode('utf-8', 'backslashreplace')
+            del line_buf[:newline_index + 1]
+            print_line_with_info_str(last_lines, info_str)
+
+    proc.stdout.close()
+    proc.wait()
+
+    # Print any partial line left over after the process has ended.
+    remaining_output = line_buf.decode('utf-8', 'backslashreplace')
 
     if remaining_output:
         print_line_with_info_str(remaining_output, info_str)
@@ -269,12 +462,48 @@ def run_subprocess(cmd_args: list[str], info_str: str, working_dir: Path = None,
         # This print makes sure that the info string is still visible when the Python exception info
         # is printed to the console.
         print('\n')
-        except_output = prev_output + output + remaining_output
+        except_output = f'{last_lines}\n{remaining_output}'
         raise subprocess.CalledProcessError(proc.returncode, cmd_args, except_output)
 
 
+def restore_mtimes_from_git(repo_dir: Path) -> None:
+    '''Set the modification times of the files in the given git repo based on its commit history
+    rather than on when they were checked out.
+
+    This uses the 'git-restore-mtime' tool if it is installed, which gives each file the time of
+    the last commit that changed it. Otherwise, every tracked file gets the time of the HEAD commit.
+    Either way, cloning the same commit again gives the same times, so a build directory kept with
+    '--incremental' does not see every file as changed after a re-clone.
+    '''
+    if shutil.which('git-restore-mtime'):
+        run_subprocess(['git-restore-mtime'], f'Restoring file times in {repo_dir.as_posix()}',
+                       repo_dir)
+        return
+
+    commit_time = int(subprocess.run(['git', 'log', '-1', '--format=%ct'], cwd=repo_dir,
+                                     capture_output=True, text=True, check=True).stdout)
+    # Read the paths as bytes because git gives them as UTF-8 no matter what the locale is, which
+    # on Windows is usually not UTF-8. The file system encoding is UTF-8 there, so os.fsdecode()
+    # gives the right names on every platform.
+    tracked_files = subprocess.run(['git', 'ls-files', '-z'], cwd=repo_dir,
+                                   capture_output=True, check=True).stdout
+
+    # Not every platform can set the times of a symlink itself (Windows cannot), so skip symlinks
+    # there rather than changing the times of whatever they point to.
+    can_set_link_times = os.utime in os.supports_follow_symlinks
+
+    for file in tracked_files.split(b'\0'):
+        if file:
+            file_path = repo_dir / os.fsdecode(file)
+            if can_set_link_times:
+                os.utime(file_path, (commit_time, commit_time), follow_symlinks=False)
+            elif not file_path.is_symlink():
+                os.utime(file_path, (commit_time, commit_time))
+
+
 def clone_from_git(url: str, branch: str = None, dest_directory: Path = None,
-                   skip_if_exists: bool = False, full_clone: bool = False) -> None:
+                   skip_if_exists: bool = False, full_clone: bool = False,
+                   restore_mtime: bool = False) -> None:
     '''Clone a git repo from the given url.
 
     Clone a git repo by calling out to the locally-installed git executable with the given URL and
@@ -284,7 +513,8 @@ def clone_from_git(url: str, branch: str = None, dest_directory: Path = None,
     True, then this will look for and inhibit errors given by git if the destination already exists;
     otherwise, the underlying subprocess code will throw a subprocess.CalledProcessError. If 
     full_clone is True, then this will clone the full repo history; otherwise, only a shallow clone
-    is made by using the "--depth=1" option.
+    is made by using the "--depth=1" option. If restore_mtime is True, then the times of the cloned
+    files are set from the git history after a successful clone.
     '''
     cmd = ['git', 'clone']
 
@@ -305,74 +535,75 @@ def clone_from_git(url: str, branch: str = None, dest_directory: Path = None,
         cmd.append(dest_directory.as_posix())
 
     try:
-        run_subprocess(cmd, 'Cloning ' + url)
+        run_subprocess(cmd, f'Cloning {url}')
     except subprocess.CalledProcessError as ex:
         if skip_if_exists  and  'already exists' in ex.output:
-            pass
+            return
         else:
             raise
 
+    if restore_mtime:
+        restore_mtimes_from_git(dest_directory or Path(Path(url).stem))
+
 
 def clone_selected_repos_from_git(args: argparse.Namespace) -> None:
     '''Clone repos from git based on the build steps and command line arguments to this script.
     '''
     if args.clone_all  or  'llvm' in args.steps  or  'runtimes' in args.steps:
         clone_from_git(LLVM_REPO_URL, args.llvm_branch, LLVM_SRC_DIR, 
-                    skip_if_exists=args.skip_existing, full_clone=args.full_clone)
+                    skip_if_exists=args.skip_existing, full_clone=args.full_clone,
+                    restore_mtime=args.restore_mtime)
 
     if args.clone_all or 'musl' in args.steps:
         clone_from_git(MUSL_REPO_URL, MUSL_REPO_BRANCH, MUSL_SRC_DIR, 
-                    skip_if_exists=args.skip_existing, full_clone=args.full_clone)
+                    skip_if_exists=args.skip_existing, full_clone=args.full_clone,
+                    restore_mtime=args.restore_mtime)
 
     if args.clone_all or 'devfiles' in args.steps:
         clone_from_git(PIC32_FILE_MAKER_REPO_URL, '', PIC32_FILE_MAKER_SRC_DIR, 
-                    skip_if_exists=args.skip_existing, full_clone=args.full_clone)
+                    skip_if_exists=args.skip_existing, full_clone=args.full_clone,
+                    restore_mtime=args.restore_mtime)
 
     if args.clone_all or 'cmsis' in args.steps:
         clone_from_git(CMSIS_REPO_URL, args.cmsis_branch, CMSIS_SRC_DIR, 
-                    skip_if_exists=args.skip_existing, full_clone=args.full_clone)
+                    skip_if_exists=args.skip_existing, full_clone=args.full_clone,
+                    restore_mtime=args.restore_mtime)
 
 
 def build_single_stage_llvm(args: argparse.Namespace) -> None:
     '''Build LLVM and its associated projects as a single-stage build.
 
-    This will remove any previous build directory so that a clean build is always performed. To
-    avoid this, enter the directory using a command line and manually start a build from there.
+    This will remove any previous build directory so that a clean build is performed unless the
+    '--incremental' option was given on the command line.
     '''
     build_dir = BUILD_PREFIX / 'llvm'
     install_dir = Path(os.path.relpath(INSTALL_PREFIX, build_dir))
     src_dir = Path(os.path.relpath(LLVM_SRC_DIR / 'llvm', build_dir))
 
-    remake_dirs(build_dir)
+    make_build_dir(args, build_dir, [LLVM_SRC_DIR])
 
     gen_cmd = [
         'cmake', '-G', 'Ninja',
         f'-DCMAKE_INSTALL_PREFIX={install_dir.as_posix()}',
         f'-DCMAKE_BUILD_TYPE={args.llvm_build_type}',
-        f'-DLLVM_ENABLE_LTO={get_cmake_bool(args.enable_lto)}',
+        f'-DLLVM_ENABLE_LTO={args.enable_lto}',
         f'-DLLVM_PARALLEL_COMPILE_JOBS={args.compile_jobs}',
         f'-DLLVM_PARALLEL_LINK_JOBS={args.link_jobs}',
-        '-DCLANG_CONFIG_FILE_SYSTEM_DIR=../config',
-        '-DLLVM_OPTIMIZED_TABLEGEN=ON',
-        '-DLLVM_USE_SPLIT_DWARF=ON',
-        '-DLLVM_TARGETS_TO_BUILD=ARM;Mips',
-        '-DLLVM_ENABLE_PROJECTS=clang;clang-tools-extra;lld;lldb;polly',
+        *LLVM_SINGLE_STAGE_CMAKE_ARGS,
         src_dir.as_posix()
     ]
-    run_subprocess(gen_cmd, 'Generate LLVM build script', build_dir)
-
-    build_cmd = ['cmake', '--build', '.']
-    run_subprocess(build_cmd, 'Build LLVM', build_dir)
+    run_cmake_configure(args, gen_cmd, 'Generate LLVM build script', build_dir)
 
-    install_cmd = ['cmake', '--build', '.', '--target', 'install']
-    run_subprocess(install_cmd, 'Install LLVM', build_dir)
+    # The install target depends on everything else, so this builds and installs in one go.
+    install_cmd = ['cmake', '--build', '.', '--target', 'install', '--parallel', str(args.compile_jobs)]
+    run_subprocess(install_cmd, 'Build and install LLVM', build_dir, passthrough=args.plain_output)
 
 
 def build_two_stage_llvm(args: argparse.Namespace) -> None:
     '''Build LLVM and its associated projects using a 2-stage build.
 
-    This will remove any previous build directory so that a clean build is always performed. To
-    avoid this, enter the directory using a command line and manually start a build from there.
+    This will remove any previous build directory so that a clean build is performed unless the
+    '--incremental' option was given on the command line.
     '''
     build_dir = BUILD_PREFIX / 'llvm'
     install_dir = Path(os.path.relpath(INSTALL_PREFIX, build_dir))
@@ -380,7 +611,7 @@ def build_two_stage_llvm(args: argparse.Namespace) -> None:
     cmake_config_path = Path(os.path.relpath(CMAKE_CACHE_DIR / 'pic32clang-llvm-stage1.cmake',
                                              build_dir))
 
-    remake_dirs(build_dir)
+    make_build_dir(args, build_dir, [LLVM_SRC_DIR])
 
     ######
     # The CMake cache files used here are based on the example configs found in
@@ -394,7 +625,7 @@ def build_two_stage_llvm(args: argparse.Namespace) -> None:
     gen_cmd = [
         'cmake', '-G', 'Ninja',
         f'-DCMAKE_INSTALL_PREFIX={install_dir.as_posix()}',
-        f'-DBOOTSTRAP_LLVM_ENABLE_LTO={get_cmake_bool(args.enable_lto)}',
+        f'-DBOOTSTRAP_LLVM_ENABLE_LTO={args.enable_lto}',
         f'-DBOOTSTRAP_CMAKE_BUILD_TYPE={args.llvm_build_type}',
         f'-DLLVM_PARALLEL_COMPILE_JOBS={args.compile_jobs}',
         f'-DLLVM_PARALLEL_LINK_JOBS={args.link_jobs}',
@@ -403,13 +634,13 @@ def build_two_stage_llvm(args: argparse.Namespace) -> None:
         '-C', cmake_config_path.as_posix(),
         src_dir.as_posix()
     ]
-    run_subprocess(gen_cmd, 'Generate LLVM build script', build_dir)
+    run_cmake_configure(args, gen_cmd, 'Generate LLVM build script', build_dir)
 
-    build_cmd = ['cmake', '--build', '.', '--target', 'stage2-distribution']
-    run_subprocess(build_cmd, 'Build LLVM', build_dir)
-
-    install_cmd = ['cmake', '--build', '.', '--target', 'stage2-install-distribution']
-    run_subprocess(install_cmd, 'Install LLVM', build_dir)
+    # Installing the distribution depends on building the distribution components, so this builds
+    # and installs in one go.
+    install_cmd = ['cmake', '--build', '.', '--target', 'stage2-install-distribution',
+                   '--parallel', str(args.compile_jobs)]
+    run_subprocess(install_cmd, 'Build and install LLVM', build_dir, passthrough=args.plain_output)
 
 
 def build_musl(args: argparse.Namespace, variant: TargetVariant):
@@ -426,8 +657,14 @@ def build_musl(args: argparse.Namespace, variant: TargetVariant):
     prefix_dir = Path(os.path.relpath(prefix, build_dir))
     lib_dir = Path(os.path.relpath(prefix / variant.path / 'lib', build_dir))
     src_dir = Path(os.path.relpath(MUSL_SRC_DIR, build_dir))
+    variant_info = get_lib_info_str(variant)
+
+    build_tool_path = get_lib_build_tool_abspath(args)
+    compiler_path = build_tool_path / 'bin' / 'clang'
 
-    remake_dirs(build_dir)
+    # Musl's Makefile does not depend on the compiler, so it would not rebuild anything after LLVM
+    # changes. Have the build directory removed in that case just like when Musl itself changes.
+    make_build_dir(args, build_dir, [MUSL_SRC_DIR, LLVM_SRC_DIR], [str(compiler_path)])
 
     #####
     # Notes:
@@ -441,13 +678,11 @@ def build_musl(args: argparse.Namespace, variant: TargetVariant):
     # --For Armv7(E)-M and Armv8M/8.1M Mainline, Clang defines both __thumb__ and __thumb2__.
     # --For Armv6-M and Armv8-M.base, only __thumb__ is defined.
 
-    build_tool_path = get_lib_build_tool_abspath(args)
-
     build_env = os.environ.copy()
     build_env['AR'] = str(build_tool_path / 'bin' / 'llvm-ar')
     build_env['RANLIB'] = str(build_tool_path / 'bin' / 'llvm-ranlib')
-    build_env['CC'] = str(build_tool_path / 'bin' / 'clang')
-    build_env['CFLAGS'] = ' '.join(variant.options) + ' -gline-tables-only'
+    build_env['CC'] = str(compiler_path)
+    build_env['CFLAGS'] = ' '.join([*variant.options, '-gline-tables-only'])
 
 # TODO: Does this need to specify a custom version string since this is my branch of Musl?
     gen_cmd = [
@@ -460,20 +695,26 @@ def build_musl(args: argparse.Namespace, variant: TargetVariant):
         '--disable-debug',
         f'--target={variant.triple}'
     ]
-    gen_build_info = f'Configure Musl ({get_lib_info_str(variant)})'
-    run_subprocess(gen_cmd, gen_build_info, build_dir, penv=build_env)
+    gen_build_info = f'Configure Musl ({variant_info})'
+    run_subprocess(gen_cmd, gen_build_info, build_dir, penv=build_env,
+                   passthrough=args.plain_output)
 
-    clean_cmd = ['make', 'clean']
-    clean_info = f'Clean Musl ({get_lib_info_str(variant)})'
-    run_subprocess(clean_cmd, clean_info, build_dir, penv=build_env)
+    if not args.incremental:
+        clean_cmd = ['make', 'clean']
+        clean_info = f'Clean Musl ({variant_info})'
+        run_subprocess(clean_cmd, clean_info, build_dir, penv=build_env,
+                       passthrough=args.plain_output)
 
     build_cmd = ['make', '--output-sync=target', f'-j{args.compile_jobs}']
-    build_info = f'Build Musl ({get_lib_info_str(variant)})'
-    run_subprocess(build_cmd, build_info, build_dir, penv=build_env)
+    build_info = f'Build Musl ({variant_info})'
+    run_subprocess(build_cmd, build_info, build_dir, penv=build_env,
+                   passthrough=args.plain_output)
 
-    install_cmd = ['make', '-j1', 'install']
-    install_info = f'Install Musl ({get_lib_info_str(variant)})'
-    run_subprocess(install_cmd, install_info, build_dir, penv=build_env)
+    install_cmd = ['make', f'-j{args.compile_jobs}', 'install']
+    install_info = f'Install Musl ({variant_info})'
+    with INSTALL_LOCK:
+        run_subprocess(install_cmd, install_info, build_dir, penv=build_env,
+                       passthrough=args.plain_output)
 
 
 def build_llvm_runtimes(args: argparse.Namespace, variant: TargetVariant):
@@ -487,47 +728,57 @@ def build_llvm_runtimes(args: argparse.Namespace, variant: TargetVariant):
     prefix = get_lib_install_prefix(variant)
     prefix_dir = Path(os.path.relpath(prefix, build_dir))
     src_dir = Path(os.path.relpath(LLVM_SRC_DIR / 'runtimes', build_dir))
+    variant_info = get_lib_info_str(variant)
 
     clang_sysroot = get_lib_build_tool_abspath(args)
     cmake_config_path = Path(os.path.relpath(CMAKE_CACHE_DIR / 'pic32clang-target-runtimes.cmake',
                                              build_dir))
 
-    remake_dirs(build_dir)
+    make_build_dir(args, build_dir, [LLVM_SRC_DIR])
 
     # Testing suggests that the CMake scripts for the runtimes detect the Arm variant (ie. armv6m)
     # from the triple rather than from the separate '-march=' option.
     if variant.arch.startswith('mips'):
         triple_str = variant.triple
     else:
-        triple_str = variant.subarch + '-none-eabi'
+        triple_str = f'{variant.subarch}-none-eabi'
 
     # TODO: The CMake script for the runtimes excludes the built-in atomics support because it fails
     #       with Armv6-m. It does not support the Arm atomic access instructions. Could we enable
     #       the atomics support for all other archs and leave out v6m?
     options_str = ';'.join(variant.options)
     gen_cmd = [
-        'cmake', '-G', 'Ninja', 
+        'cmake', '-G', 'Ninja',
         f'-DCMAKE_INSTALL_PREFIX={prefix_dir.as_posix()}',
         # This suffix goes up a level because the LLVM CMake scripts add an extra '/lib/' we don't want.
         f'-DPIC32CLANG_LIBDIR_SUFFIX=../{variant.path.as_posix()}/lib',
         f'-DPIC32CLANG_TARGET_TRIPLE={triple_str}',
         f'-DPIC32CLANG_RUNTIME_FLAGS={options_str}',
         f'-DPIC32CLANG_SYSROOT={clang_sysroot.as_posix()}',
+        *get_compiler_launcher_args(),
         f'-DLLVM_PARALLEL_COMPILE_JOBS={args.compile_jobs}',
         f'-DLLVM_PARALLEL_LINK_JOBS={args.link_jobs}',
         '-C', cmake_config_path.as_posix(),
         src_dir.as_posix()
     ]
-    gen_build_info = f'Generate runtimes build script ({get_lib_info_str(variant)})'
-    run_subprocess(gen_cmd, gen_build_info, build_dir)
-
-    build_cmd = ['cmake', '--build', '.']
-    build_info = f'Build runtimes ({get_lib_info_str(variant)})'
-    run_subprocess(build_cmd, build_info, build_dir)
+    gen_build_info = f'Generate runtimes build script ({variant_info})'
+    run_cmake_configure(args, gen_cmd, gen_build_info, build_dir)
+
+    # The install target depends on everything else, so one call can build and install. When other
+    # variants are being built at the same time, build first so that only the install itself has
+    # to wait its turn for the install lock.
+    build_cmd = ['cmake', '--build', '.', '--parallel', str(args.compile_jobs)]
+    install_cmd = build_cmd + ['--target', 'install']
+
+    if args.variant_jobs > 1:
+        build_info = f'Build runtimes ({variant_info})'
+        run_subprocess(build_cmd, build_info, build_dir, passthrough=args.plain_output)
+        install_info = f'Install runtimes ({variant_info})'
+    else:
+        install_info = f'Build and install runtimes ({variant_info})'
 
-    install_cmd = ['cmake', '--build', '.', '--target', 'install']
-    install_info = f'Install runtimes ({get_lib_info_str(variant)})'
-    run_subprocess(install_cmd, install_info, build_dir)
+    with INSTALL_LOCK:
+        run_subprocess(install_cmd, install_info, build_dir, passthrough=args.plain_output)
 
     # Compiler-RT is built to include the arch name in the library name unless we let CMake decide
     # the directories to install them (option LLVM_ENABLE_PER_TARGET_RUNTIME_DIR). That ends up
@@ -537,10 +788,45 @@ def build_llvm_runtimes(args: argparse.Namespace, variant: TargetVariant):
     for crt in compiler_rt_path.iterdir():
         if crt.name.startswith('libclang_rt.'):
             subname = crt.stem[12:].split('-', 1)
-            crt.rename(crt.parent / f'libclang_rt.{subname[0]}{crt.suffix}')
+            crt.replace(crt.parent / f'libclang_rt.{subname[0]}{crt.suffix}')
         elif crt.name.startswith('clang_rt.'):
             subname = crt.stem[9:].split('-', 1)
-            crt.rename(crt.parent / f'clang_rt.{subname[0]}{crt.suffix}')
+            crt.replace(crt.parent / f'clang_rt.{subname[0]}{crt.suffix}')
+
+
+def build_for_all_variants(args: argparse.Namespace, variants: Iterable[TargetVariant],
+                           build_funcs: list[Callable[[argparse.Namespace, TargetVariant], None]]
+                           ) -> None:
+    '''Build libraries for each of the given build variants.
+
+    Each build function is called once per variant with the command-line arguments and the variant,
+    so this works with build_musl(), build_llvm_runtimes(), and anything else with that signature.
+    The functions are called in the order given for one variant before moving on to the next. This
+    means that a later library can depend on an earlier one being built for the same variant.
+
+    Up to '--variant-jobs' variants are built at the same time. Threads are enough here because the
+    real work is done by the build tools in their own processes. Since each variant goes through all
+    of the build functions on its own, one variant can be building its runtimes while another is
+    still building Musl. If a build fails, then no more builds are started, but the ones already
+    running are allowed to finish before the exception is passed on.
+    '''
+    def build_variant(variant: TargetVariant) -> None:
+        for build_func in build_funcs:
+            build_func(args, variant)
+
+    if args.variant_jobs <= 1:
+        for variant in variants:
+            build_variant(variant)
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.variant_jobs) as pool:
+        futures = [pool.submit(build_variant, variant) for variant in variants]
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+        except BaseException:
+            pool.shutdown(cancel_futures=True)
+            raise
 
 
 def build_device_files(args: argparse.Namespace) -> None:
@@ -557,7 +843,8 @@ def build_device_files(args: argparse.Namespace) -> None:
         '--output-dir', output_dir.as_posix(),
         args.packs_dir.as_posix()
     ]
-    run_subprocess(build_cmd, 'Make device-specifc files', PIC32_FILE_MAKER_SRC_DIR)
+    run_subprocess(build_cmd, 'Make device-specifc files', PIC32_FILE_MAKER_SRC_DIR,
+                   passthrough=args.plain_output)
 
     # Now copy the created files into the install location.
     #
@@ -642,9 +929,17 @@ def get_command_line_arguments() -> argparse.Namespace:
     parser.add_argument('--skip-existing',
                         action='store_true',
                         help='skip cloning repos that already exist instead of raising an exception')
-    parser.add_argument('--enable-lto',
+    parser.add_argument('--restore-mtime',
                         action='store_true',
-                        help='enable Link Time Optimization for LLVM')
+                        help='set the times of cloned files from their git history')
+    parser.add_argument('--enable-lto',
+                        nargs='?',
+                        const='Full',
+                        default='Off',
+                        type=str.capitalize,
+                        choices=['Off', 'Full', 'Thin'],
+                        metavar='MODE',
+                        help='enable Link Time Optimization for LLVM (Full if MODE is not given)')
     parser.add_argument('--single-stage',
                         action='store_true',
                         help='do a single-stage LLVM build instead of two-stage')
@@ -658,6 +953,17 @@ def get_command_line_arguments() -> argparse.Namespace:
                         default=0,
                         metavar='JOBS',
                         help='number of parallel link jobs')
+    parser.add_argument('--variant-jobs',
+                        type=int,
+                        default=1,
+                        metavar='JOBS',
+                        help='number of library variants to build at the same time')
+    parser.add_argument('--incremental',
+                        action='store_true',
+                        help='reuse existing build directories instead of doing clean builds')
+    parser.add_argument('--plain-output',
+                        action='store_true',
+                        help='let build tools print directly to the console without a status line')
     parser.add_argument('--version', action='version',
                         version=version_str)
 
@@ -709,6 +1015,9 @@ def process_command_line_arguments(args: argparse.Namespace) -> None:
     if args.link_jobs <= 0  or  args.link_jobs > max_jobs:
         args.link_jobs = max_jobs
 
+    if args.variant_jobs <= 0:
+        args.variant_jobs = 1
+
 
 def print_arg_info(args: argparse.Namespace) -> None:
     '''Print some info indicating what arguments were selected, which might be useful for logging.
@@ -722,6 +1031,7 @@ def print_arg_info(args: argparse.Namespace) -> None:
     print(f'Packs directory: {args.packs_dir}')
     print(f'Compile jobs: {args.compile_jobs}')
     print(f'Link jobs: {args.link_jobs}')
+    print(f'Variant jobs: {args.variant_jobs}')
 
     if os.path.exists(args.packs_dir):
         print('Packs dir found')
@@ -733,16 +1043,34 @@ def print_arg_info(args: argparse.Namespace) -> None:
     else:
         print('Will do two-stage build')
 
-    if args.enable_lto:
-        print('LTO enabled')
+    if args.enable_lto != 'Off':
+        print(f'LTO enabled ({args.enable_lto})')
     else:
         print('LTO disabled')
 
+    if get_compiler_launcher_args():
+        print('Compiler cache found and will be used for the runtimes')
+    else:
+        print('No compiler cache found')
+
+    if args.incremental:
+        print('Reusing existing build directories')
+    else:
+        print('Doing clean builds')
+
+    if args.plain_output:
+        print('Build tools will print directly to the console')
+    else:
+        print('Build output will be shown with a status line')
+
     if args.full_clone:
         print('Doing a full clone of the git repos')
     else:
         print('Doing a shallow clone of the git repos')
     
+    if args.restore_mtime:
+        print('Restoring file times of cloned repos from git')
+
     if args.clone_all:
         print('Cloning all repos even if that step is not selected')
     else:
@@ -786,15 +1114,19 @@ if '__main__' == __name__:
         else:
             build_two_stage_llvm(args)
 
-    build_variants: list[TargetVariant] = pic32_target_variants.create_build_variants()
+    build_variants: Iterable[TargetVariant] = pic32_target_variants.create_build_variants()
+
+    # The runtimes need the Musl headers, so Musl is built first for each variant.
+    variant_build_funcs = []
 
     if 'musl' in args.steps:
-        for variant in build_variants:
-            build_musl(args, variant)
+        variant_build_funcs.append(build_musl)
 
     if 'runtimes' in args.steps:
-        for variant in build_variants:
-            build_llvm_runtimes(args, variant)
+        variant_build_funcs.append(build_llvm_runtimes)
+
+    if variant_build_funcs:
+        build_for_all_variants(args, build_variants, variant_build_funcs)
 
     if 'devfiles' in args.steps:
         build_device_files(args)
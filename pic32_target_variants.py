@@ -39,7 +39,9 @@
 # I moved the target variant stuff in here mostly to reduce some clutter in the main script.
 #
 
+from collections.abc import Callable, Iterator
 from dataclasses import dataclass
+from itertools import chain
 from pathlib import Path
 
 # Notes:
@@ -56,160 +58,192 @@ from pathlib import Path
 # -- The M4 has a 32-bit FPU; the M7 has a 64-bit FPU. These are Armv7em.
 # -- The A5 can have either a normal 64-bit FPU or one with NEON. This is Armv7a.
 # -- The M series is always Thumb, so we do not have to differentiate.
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class TargetVariant:
     arch : str
     triple : str
     path : Path
     subarch : str
-    options : list[str]
+    options : tuple[str, ...]
 
-@dataclass(frozen=True)
-class Mips32Variant(TargetVariant):
-    def __init__(self, multilib_path: Path, subarch: str, options: list[str]) -> None:
-        # '-G0' prevents libraries from putting small globals into the small data sections. This
-        # is the safest option since an application can control the size threshold with '-G<size>'.
-        common_opts = ['-target', 'mipsel-linux-gnu', '-G0', '-fomit-frame-pointer']
-        all_opts = common_opts + options
+# These options are added to the options of every target in the given device family.
+#
+# '-G0' prevents libraries from putting small globals into the small data sections. This is the
+# safest option since an application can control the size threshold with '-G<size>'.
+MIPS32_COMMON_OPTS = ('-target', 'mipsel-linux-gnu', '-G0', '-fomit-frame-pointer')
+
+# The '-mimplicit-it' flag is needed for Musl. Whatever options I'm passing are causing the Musl
+# configure script to not pick that up automatically.
+ARM_COMMON_OPTS = ('-target', 'arm-none-eabi', '-mimplicit-it=always', '-fomit-frame-pointer')
+
+def make_mips32_variant(multilib_path: Path,
+                        subarch: str,
+                        options: tuple[str, ...]) -> TargetVariant:
+    '''Make a target variant for a MIPS32 device with the common MIPS options added.
+    '''
+    all_opts = MIPS32_COMMON_OPTS + options
 
-        return super().__init__('mips32', 'mipsel-linux-gnu', multilib_path, subarch, all_opts)
+    return TargetVariant('mips32', 'mipsel-linux-gnu', multilib_path, subarch, all_opts)
 
-@dataclass(frozen=True)
-class CortexMVariant(TargetVariant):
-    def __init__(self, multilib_path: Path, subarch: str, options: list[str]) -> None:
-        # The '-mimplicit-it' flag is needed for Musl. Whatever options I'm passing are causing the
-        # Musl configure script to not pick that up automatically.
-        common_opts = ['-target', 'arm-none-eabi', '-mimplicit-it=always', '-fomit-frame-pointer']
-        all_opts = common_opts + options
+def make_cortex_m_variant(multilib_path: Path,
+                          subarch: str,
+                          options: tuple[str, ...]) -> TargetVariant:
+    '''Make a target variant for an Arm Cortex-M device with the common Arm options added.
+    '''
+    all_opts = ARM_COMMON_OPTS + options
 
-        return super().__init__('cortex-m', 'arm-none-eabi', multilib_path, subarch, all_opts)
+    return TargetVariant('cortex-m', 'arm-none-eabi', multilib_path, subarch, all_opts)
 
-@dataclass(frozen=True)
-class CortexAVariant(TargetVariant):
-    def __init__(self, multilib_path: Path, subarch: str, options: list[str]) -> None:
-        # The '-mimplicit-it' flag is needed for Musl. Whatever options I'm passing are causing the
-        # Musl configure script to not pick that up automatically.
-        common_opts = ['-target', 'arm-none-eabi', '-mimplicit-it=always', '-fomit-frame-pointer']
-        all_opts = common_opts + options
+def make_cortex_a_variant(multilib_path: Path,
+                          subarch: str,
+                          options: tuple[str, ...]) -> TargetVariant:
+    '''Make a target variant for an Arm Cortex-A device with the common Arm options added.
+    '''
+    all_opts = ARM_COMMON_OPTS + options
 
-        return super().__init__('cortex-a', 'arm-none-eabi', multilib_path, subarch, all_opts)
+    return TargetVariant('cortex-a', 'arm-none-eabi', multilib_path, subarch, all_opts)
 
 
 # The paths here are set up to match paths provided by the multilib.yaml file generated by the
 # 'pic32-device-file-maker' project. If you need to change them here, then you'll need to change
 # them in that project, too. The YAML file is in the "premade" directory in that project.
-TARGETS = [
-    # Mips32Variant(Path('r2/nofp'),
-    #               'mips32r2',
-    #               ['-march=mips32r2', '-msoft-float']),
-    # Mips32Variant(Path('r2/mips16/nofp'),
-    #               'mips32r2',
-    #               ['-march=mips32r2', '-mips16', '-msoft-float']),
-    # Mips32Variant(Path('r2/micromips/nofp'),
-    #               'mips32r2',
-    #               ['-march=mips32r2', '-mmicromips', '-msoft-float']),
-    # Mips32Variant(Path('r2/micromips/dspr2/nofp'),
-    #               'mips32r2',
-    #               ['-march=mips32r2', '-mmicromips', '-mdspr2', '-msoft-float']),
-    # Mips32Variant(Path('r2/dspr2/nofp'),
-    #               'mips32r2',
-    #               ['-march=mips32r2', '-mdspr2', '-msoft-float']),
-    # Mips32Variant(Path('r5/dspr2/nofp'),
-    #               'mips32r2',
-    #               ['-march=mips32r5', '-mdspr2', '-msoft-float']),
-    # Mips32Variant(Path('r5/dspr2/fpu64'),
-    #               'mips32r5',
-    #               ['-march=mips32r5', '-mdspr2', '-mhard-float', '-mfp64']),
-    # Mips32Variant(Path('r5/micromips/dspr2/nofp'),
-    #               'mips32r5',
-    #               ['-march=mips32r5', '-mmicromips', '-mdspr2', '-msoft-float']),
-    # Mips32Variant(Path('r5/micromips/dspr2/fpu64'),
-    #               'mips32r5',
-    #               ['-march=mips32r5', '-mmicromips', '-mdspr2', '-mhard-float', '-mfp64']),
-
-    CortexMVariant(Path('v6m/nofp'),
-                   'armv6m',
-                   ['-march=armv6m', '-mfpu=none', '-mfloat-abi=soft']),
-    CortexMVariant(Path('v7m/nofp'),
-                   'armv7m',
-                   ['-march=armv7m', '-mfpu=none', '-mfloat-abi=soft']),
-    CortexMVariant(Path('v7em/nofp'),
-                   'armv7em',
-                   ['-march=armv7em', '-mfpu=none', '-mfloat-abi=soft']),
-    CortexMVariant(Path('v7em/fpv4-sp-d16'),
-                   'armv7em',
-                   ['-march=armv7em', '-mfpu=fpv4-sp-d16', '-mfloat-abi=hard']),
-    CortexMVariant(Path('v7em/fpv5-d16'),
-                   'armv7em',
-                   ['-march=armv7em', '-mfpu=fpv5-d16', '-mfloat-abi=hard']),
-    CortexMVariant(Path('v8m.base/nofp'),
-                   'armv8m.base',
-                   ['-march=armv8m.base', '-mfpu=none', '-mfloat-abi=soft']),
-    CortexMVariant(Path('v8m.main/nofp'),
-                   'armv8m.main',
-                   ['-march=armv8m.main', '-mfpu=none', '-mfloat-abi=soft']),
-    CortexMVariant(Path('v8m.main/fpv5-sp-d16'),
-                   'armv8m.main',
-                   ['-march=armv8m.main', '-mfpu=fpv5-sp-d16', '-mfloat-abi=hard']),
-    CortexMVariant(Path('v8.1m.main/nofp/nomve'),
-                   'armv8.1m.main',
-                   ['-march=armv8.1m.main', '-mfpu=none', '-mfloat-abi=soft']),
-    CortexMVariant(Path('v8.1m.main/nofp/mve'),
-                   'armv8.1m.main+mve',
-                   ['-march=armv8.1m.main+mve', '-mfpu=none', '-mfloat-abi=hard']), # MVE needs hard ABI
-    CortexMVariant(Path('v8.1m.main/fp-armv8-fullfp16-d16/nomve'),
-                   'armv8.1m.main',
-                   ['-march=armv8.1m.main', '-mfpu=fp-armv8-fullfp16-d16', '-mfloat-abi=hard']),
-    CortexMVariant(Path('v8.1m.main/fp-armv8-fullfp16-d16/mve'),
-                   'armv8.1m.main+mve.fp+fp.dp',
-                   ['-march=armv8.1m.main+mve.fp+fp.dp', '-mfpu=fp-armv8-fullfp16-d16', '-mfloat-abi=hard']),
-
-    # CortexAVariant(Path('v7a/nofp'),
-    #                'armv7a',
-    #                ['-march=armv7a', '-mfpu=none', '-mfloat-abi=soft']),
-    # CortexAVariant(Path('v7a/vfpv4-d16'),
-    #                'armv7a',
-    #                ['-march=armv7a', '-mfpu=vfpv4-d16', '-mfloat-abi=hard']),
-    # CortexAVariant(Path('v7a/neon-vfpv4'),
-    #                'armv7a',
-    #                ['-march=armv7a', '-mfpu=neon-vfpv4', '-mfloat-abi=hard']),
-    # CortexAVariant(Path('v7a/thumb/nofp'),
-    #                'armv7a',
-    #                 ['-march=armv7a', '-mthumb', '-mfpu=none', '-mfloat-abi=soft']),
-    # CortexAVariant(Path('v7a/thumb/vfpv4-d16'),
-    #                'armv7a',
-    #                ['-march=armv7a', '-mthumb', '-mfpu=vfpv4-d16', '-mfloat-abi=hard']),
-    # CortexAVariant(Path('v7a/thumb/neon-vfpv4'),
-    #                'armv7a',
-    #                ['-march=armv7a', '-mthumb', '-mfpu=neon-vfpv4', '-mfloat-abi=hard']),
-    ]
-
-def create_build_variants() -> list[TargetVariant]:
-    '''Create a list of build variants that are used to build supporting libraries for the toolchain.
+def _mips32_targets() -> tuple[TargetVariant, ...]:
+    '''Get the targets for the PIC32M devices.
+    '''
+    return (
+        make_mips32_variant(Path('r2/nofp'),
+                            'mips32r2',
+                            ('-march=mips32r2', '-msoft-float')),
+        # make_mips32_variant(Path('r2/mips16/nofp'),
+        #                     'mips32r2',
+        #                     ('-march=mips32r2', '-mips16', '-msoft-float')),
+        make_mips32_variant(Path('r2/micromips/nofp'),
+                            'mips32r2',
+                            ('-march=mips32r2', '-mmicromips', '-msoft-float')),
+        make_mips32_variant(Path('r2/micromips/dspr2/nofp'),
+                            'mips32r2',
+                            ('-march=mips32r2', '-mmicromips', '-mdspr2', '-msoft-float')),
+        make_mips32_variant(Path('r2/dspr2/nofp'),
+                            'mips32r2',
+                            ('-march=mips32r2', '-mdspr2', '-msoft-float')),
+        make_mips32_variant(Path('r5/dspr2/nofp'),
+                            'mips32r2',
+                            ('-march=mips32r5', '-mdspr2', '-msoft-float')),
+        make_mips32_variant(Path('r5/dspr2/fpu64'),
+                            'mips32r5',
+                            ('-march=mips32r5', '-mdspr2', '-mhard-float', '-mfp64')),
+        make_mips32_variant(Path('r5/micromips/dspr2/nofp'),
+                            'mips32r5',
+                            ('-march=mips32r5', '-mmicromips', '-mdspr2', '-msoft-float')),
+        # make_mips32_variant(Path('r5/micromips/dspr2/fpu64'),
+        #                     'mips32r5',
+        #                     ('-march=mips32r5', '-mmicromips', '-mdspr2', '-mhard-float',
+        #                      '-mfp64')),
+        )
+
+def _cortex_m_targets() -> tuple[TargetVariant, ...]:
+    '''Get the targets for the Arm Cortex-M based SAM and PIC32C devices.
+    '''
+    return (
+        make_cortex_m_variant(Path('v6m/nofp'),
+                              'armv6m',
+                              ('-march=armv6m', '-mfpu=none', '-mfloat-abi=soft')),
+        make_cortex_m_variant(Path('v7m/nofp'),
+                              'armv7m',
+                              ('-march=armv7m', '-mfpu=none', '-mfloat-abi=soft')),
+        make_cortex_m_variant(Path('v7em/nofp'),
+                              'armv7em',
+                              ('-march=armv7em', '-mfpu=none', '-mfloat-abi=soft')),
+        make_cortex_m_variant(Path('v7em/fpv4-sp-d16'),
+                              'armv7em',
+                              ('-march=armv7em', '-mfpu=fpv4-sp-d16', '-mfloat-abi=hard')),
+        make_cortex_m_variant(Path('v7em/fpv5-d16'),
+                              'armv7em',
+                              ('-march=armv7em', '-mfpu=fpv5-d16', '-mfloat-abi=hard')),
+        make_cortex_m_variant(Path('v8m.base/nofp'),
+                              'armv8m.base',
+                              ('-march=armv8m.base', '-mfpu=none', '-mfloat-abi=soft')),
+        make_cortex_m_variant(Path('v8m.main/nofp'),
+                              'armv8m.main',
+                              ('-march=armv8m.main', '-mfpu=none', '-mfloat-abi=soft')),
+        make_cortex_m_variant(Path('v8m.main/fpv5-sp-d16'),
+                              'armv8m.main',
+                              ('-march=armv8m.main', '-mfpu=fpv5-sp-d16', '-mfloat-abi=hard')),
+        make_cortex_m_variant(Path('v8.1m.main/nofp/nomve'),
+                              'armv8.1m.main',
+                              ('-march=armv8.1m.main', '-mfpu=none', '-mfloat-abi=soft')),
+        make_cortex_m_variant(Path('v8.1m.main/nofp/mve'),
+                              'armv8.1m.main+mve',
+                              # MVE needs hard ABI
+                              ('-march=armv8.1m.main+mve', '-mfpu=none', '-mfloat-abi=hard')),
+        make_cortex_m_variant(Path('v8.1m.main/fp-armv8-fullfp16-d16/nomve'),
+                              'armv8.1m.main',
+                              ('-march=armv8.1m.main', '-mfpu=fp-armv8-fullfp16-d16',
+                               '-mfloat-abi=hard')),
+        make_cortex_m_variant(Path('v8.1m.main/fp-armv8-fullfp16-d16/mve'),
+                              'armv8.1m.main+mve.fp+fp.dp',
+                              ('-march=armv8.1m.main+mve.fp+fp.dp', '-mfpu=fp-armv8-fullfp16-d16',
+                               '-mfloat-abi=hard')),
+        )
+
+def _cortex_a_targets() -> tuple[TargetVariant, ...]:
+    '''Get the targets for the Arm Cortex-A based SAM devices.
+    '''
+    return (
+        make_cortex_a_variant(Path('v7a/nofp'),
+                              'armv7a',
+                              ('-march=armv7a', '-mfpu=none', '-mfloat-abi=soft')),
+        make_cortex_a_variant(Path('v7a/vfpv4-d16'),
+                              'armv7a',
+                              ('-march=armv7a', '-mfpu=vfpv4-d16', '-mfloat-abi=hard')),
+        make_cortex_a_variant(Path('v7a/neon-vfpv4'),
+                              'armv7a',
+                              ('-march=armv7a', '-mfpu=neon-vfpv4', '-mfloat-abi=hard')),
+        make_cortex_a_variant(Path('v7a/thumb/nofp'),
+                              'armv7a',
+                              ('-march=armv7a', '-mthumb', '-mfpu=none', '-mfloat-abi=soft')),
+        make_cortex_a_variant(Path('v7a/thumb/vfpv4-d16'),
+                              'armv7a',
+                              ('-march=armv7a', '-mthumb', '-mfpu=vfpv4-d16', '-mfloat-abi=hard')),
+        make_cortex_a_variant(Path('v7a/thumb/neon-vfpv4'),
+                              'armv7a',
+                              ('-march=armv7a', '-mthumb', '-mfpu=neon-vfpv4', '-mfloat-abi=hard')),
+        )
+
+# Each group of targets is created only if its name is in ENABLED_TARGET_GROUPS, so adding support
+# for a device family later means adding it to that tuple. MIPS and Cortex-A are not yet supported.
+TARGET_GROUPS: dict[str, Callable[[], tuple[TargetVariant, ...]]] = {
+    'mips32': _mips32_targets,
+    'cortex-m': _cortex_m_targets,
+    'cortex-a': _cortex_a_targets,
+}
+
+ENABLED_TARGET_GROUPS = ('cortex-m',)
+
+TARGETS = tuple(chain.from_iterable(TARGET_GROUPS[group]() for group in ENABLED_TARGET_GROUPS))
+
+def create_build_variants() -> Iterator[TargetVariant]:
+    '''Generate the build variants that are used to build supporting libraries for the toolchain.
     
     This uses the list of targets above and creates new versions that vary by the optimization options
     to be used. Each target in the list above will therefore have several versions that differ by
     the optimization options used to build them. Each optimization variant also has its own path.
+    The variants are created as they are needed, so the caller can iterate over them only once.
     '''
-    variants: list[TargetVariant] = []
-    # opts = [(Path('.'),  ['-O0']),
-    #         (Path('o1'), ['-O1']),
-    #         (Path('o2'), ['-O2']),
-    #         (Path('o3'), ['-O3']),
-    #         (Path('os'), ['-Os']),
-    #         (Path('oz'), ['-Oz'])]
+    # opts = ((Path('.'),  ('-O0',)),
+    #         (Path('o1'), ('-O1',)),
+    #         (Path('o2'), ('-O2',)),
+    #         (Path('o3'), ('-O3',)),
+    #         (Path('os'), ('-Os',)),
+    #         (Path('oz'), ('-Oz',)))
     
     # Clang's multilib support looks for architecture options (like --target and -march),
     # -f(no-)rtti, and -f(no-)exceptions. It cannot differentiate based on other options, like
     # optimization levels. For now, just use -O2. We might need to handle the -fexceptions and
     # -frtti options in the future.
-    opts = [(Path('.'), ['-O2'])]
+    opts = ((Path('.'), ('-O2',)),)
 
     for target in TARGETS:
-        for opt in opts:
-            variant_path = target.path / opt[0]
-            variant_options = target.options + opt[1]
-            variants.append(TargetVariant(target.arch, target.triple, variant_path, 
-                                          target.subarch, variant_options))
-
-    return variants
+        for opt_path, opt_options in opts:
+            yield TargetVariant(target.arch, target.triple, target.path / opt_path, target.subarch,
+                                target.options + opt_options)